@@ -11,6 +11,7 @@ from pathlib import Path
 import tempfile
 import os
 import sys
+import orjson
 
 # Add parent directory to path to import backend modules
 sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -18,32 +19,38 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from main import app
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def client():
     """
-    Create a test client for FastAPI application.
+    Create a test client for FastAPI application, shared across the session.
     
-    Returns:
+    Entered as a context manager so application startup/shutdown runs once
+    and the underlying transport is reused by every test. Tests isolate state
+    through clear_cache rather than through the client.
+    
+    Yields:
         TestClient instance for making HTTP requests to the API
     """
-    return TestClient(app)
+    with TestClient(app) as test_client:
+        yield test_client
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_transaction_data():
     """
     Create sample transaction data for testing.
     
     Returns:
-        DataFrame with sample transaction records including edge cases
+        DataFrame with sample transaction records for three customers
+        (enough to fit the default 3 KMeans clusters), including edge cases
     """
     base_date = datetime(2023, 1, 1)
     
     data = {
-        "Invoice": ["INV001", "INV001", "INV002", "INV003", "INV004", "INV005", "INV006"],
-        "StockCode": ["PROD001", "PROD002", "PROD001", "PROD003", "PROD001", "PROD002", "PROD004"],
-        "Description": ["Product 1", "Product 2", "Product 1", "Product 3", "Product 1", "Product 2", "Product 4"],
-        "Quantity": [5, 3, 2, 10, 1, 4, 0],  # Includes zero quantity
+        "Invoice": ["INV001", "INV001", "INV002", "INV003", "INV004", "INV005", "INV006", "INV007", "INV008"],
+        "StockCode": ["PROD001", "PROD002", "PROD001", "PROD003", "PROD001", "PROD002", "PROD004", "PROD003", "PROD002"],
+        "Description": ["Product 1", "Product 2", "Product 1", "Product 3", "Product 1", "Product 2", "Product 4", "Product 3", "Product 2"],
+        "Quantity": [5, 3, 2, 10, 1, 4, 0, 2, 6],  # Includes zero quantity
         "InvoiceDate": [
             base_date,
             base_date,
@@ -51,11 +58,14 @@ def sample_transaction_data():
             base_date + timedelta(days=60),
             base_date + timedelta(days=90),
             base_date + timedelta(days=120),
-            base_date + timedelta(days=150)
+            base_date + timedelta(days=150),
+            base_date + timedelta(days=45),
+            base_date + timedelta(days=105)
         ],
-        "Price": [10.0, 15.0, 10.0, 20.0, 10.0, 15.0, 5.0],
-        "Customer ID": [12345.0, 12345.0, 12345.0, 12345.0, 12345.0, 12345.0, 67890.0],
-        "Country": ["UK", "UK", "UK", "UK", "UK", "UK", "US"]
+        "Price": [10.0, 15.0, 10.0, 20.0, 10.0, 15.0, 5.0, 12.5, 8.0],
+        # Three customers, one per KMeans cluster
+        "Customer ID": [12345.0, 12345.0, 12345.0, 12345.0, 12345.0, 12345.0, 67890.0, 24680.0, 24680.0],
+        "Country": ["UK", "UK", "UK", "UK", "UK", "UK", "US", "FR", "FR"]
     }
     
     df = pd.DataFrame(data)
@@ -63,6 +73,35 @@ def sample_transaction_data():
 
 
 @pytest.fixture
+def empty_transaction_data():
+    """
+    Create an empty transaction DataFrame for edge-case testing.
+    
+    Returns:
+        DataFrame with transaction columns and no rows
+    """
+    return pd.DataFrame(columns=["Invoice", "Price", "Quantity", "Customer ID"])
+
+
+@pytest.fixture(scope="session")
+def features_bundle(sample_transaction_data):
+    """
+    Run add_features() on the sample transaction data once per session.
+    
+    Feature creation fits KMeans, so sharing one result across the pipeline
+    tests avoids refitting per test. Consumers treat the frames as read-only.
+    
+    Args:
+        sample_transaction_data: Fixture providing sample DataFrame
+    
+    Returns:
+        Tuple of (full_df, invoice_df, customer_df) from add_features()
+    """
+    from utils.pipelines import add_features
+    return add_features(sample_transaction_data.copy())
+
+
+@pytest.fixture(scope="session")
 def sample_transaction_data_with_nulls():
     """
     Create sample transaction data with null values for testing null handling.
@@ -73,14 +112,21 @@ def sample_transaction_data_with_nulls():
     base_date = datetime(2023, 1, 1)
     
     data = {
-        "Invoice": ["INV001", "INV002", "INV003"],
-        "StockCode": ["PROD001", "PROD002", "PROD003"],
-        "Description": ["Product 1", "Product 2", "Product 3"],
-        "Quantity": [5, 3, 2],
-        "InvoiceDate": [base_date, base_date + timedelta(days=30), base_date + timedelta(days=60)],
-        "Price": [10.0, 15.0, 20.0],
-        "Customer ID": [12345.0, None, 12345.0],  # One null customer ID
-        "Country": ["UK", "UK", "UK"]
+        "Invoice": ["INV001", "INV002", "INV003", "INV004", "INV005"],
+        "StockCode": ["PROD001", "PROD002", "PROD003", "PROD001", "PROD002"],
+        "Description": ["Product 1", "Product 2", "Product 3", "Product 1", "Product 2"],
+        "Quantity": [5, 3, 2, 4, 1],
+        "InvoiceDate": [
+            base_date,
+            base_date + timedelta(days=30),
+            base_date + timedelta(days=60),
+            base_date + timedelta(days=20),
+            base_date + timedelta(days=40)
+        ],
+        "Price": [10.0, 15.0, 20.0, 12.0, 8.0],
+        # One null customer ID; three valid customers remain for KMeans
+        "Customer ID": [12345.0, None, 12345.0, 24680.0, 13579.0],
+        "Country": ["UK", "UK", "UK", "FR", "US"]
     }
     
     df = pd.DataFrame(data)
@@ -112,40 +158,110 @@ def sample_transaction_data_with_negatives():
     return df
 
 
-@pytest.fixture
-def sample_parquet_file(sample_transaction_data, tmp_path):
+@pytest.fixture(scope="session")
+def sample_parquet_file(sample_transaction_data, tmp_path_factory):
     """
-    Create a temporary parquet file with sample data.
+    Create a parquet file with sample data, written once per test session.
+    
+    The file is read-only for every consumer, so sharing it is safe.
     
     Args:
         sample_transaction_data: Fixture providing sample DataFrame
-        tmp_path: Pytest temporary directory fixture
+        tmp_path_factory: Pytest session-scoped temporary directory factory
     
     Returns:
         Path to temporary parquet file
     """
-    parquet_path = tmp_path / "test_data.parquet"
+    parquet_path = tmp_path_factory.mktemp("parquet") / "test_data.parquet"
     sample_transaction_data.to_parquet(parquet_path, engine="fastparquet", index=False)
     return str(parquet_path)
 
 
-@pytest.fixture
-def sample_parquet_file_with_nulls(sample_transaction_data_with_nulls, tmp_path):
+@pytest.fixture(scope="session")
+def ingested_sample_df(sample_parquet_file):
     """
-    Create a temporary parquet file with null values.
+    Ingest sample_parquet_file through ingest_data() once per session.
+    
+    Args:
+        sample_parquet_file: Fixture providing path to sample parquet file
+    
+    Returns:
+        DataFrame returned by ingest_data() for the sample file
+    """
+    from utils.pipelines import ingest_data
+    return ingest_data(sample_parquet_file)
+
+
+@pytest.fixture(scope="session")
+def sample_parquet_file_with_nulls(sample_transaction_data_with_nulls, tmp_path_factory):
+    """
+    Create a parquet file with null values, written once per test session.
     
     Args:
         sample_transaction_data_with_nulls: Fixture providing DataFrame with nulls
-        tmp_path: Pytest temporary directory fixture
+        tmp_path_factory: Pytest session-scoped temporary directory factory
     
     Returns:
         Path to temporary parquet file
     """
-    parquet_path = tmp_path / "test_data_nulls.parquet"
+    parquet_path = tmp_path_factory.mktemp("parquet") / "test_data_nulls.parquet"
     sample_transaction_data_with_nulls.to_parquet(parquet_path, engine="fastparquet", index=False)
     return str(parquet_path)
 
 
+@pytest.fixture(scope="session")
+def sample_parquet_bytes(sample_parquet_file):
+    """
+    Read sample_parquet_file once so uploads can be served from memory.
+    
+    Args:
+        sample_parquet_file: Fixture providing path to sample parquet file
+    
+    Returns:
+        Raw bytes of the sample parquet file
+    """
+    return Path(sample_parquet_file).read_bytes()
+
+
+@pytest.fixture(scope="session")
+def sample_upload_body(sample_parquet_bytes):
+    """
+    Encode the multipart/form-data upload of sample_parquet_file once per session.
+    
+    Tests post the returned body as raw content instead of having the client
+    re-encode the multipart form on every request.
+    
+    Args:
+        sample_parquet_bytes: Fixture providing the sample parquet file contents
+    
+    Returns:
+        Tuple of (encoded request body, Content-Type header value)
+    """
+    boundary = "gifts-exercise-test-boundary"
+    body = b"".join([
+        f"--{boundary}\r\n".encode(),
+        b'Content-Disposition: form-data; name="file"; filename="test_data.parquet"\r\n',
+        b"Content-Type: application/octet-stream\r\n\r\n",
+        sample_parquet_bytes,
+        f"\r\n--{boundary}--\r\n".encode()
+    ])
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+@pytest.fixture(scope="session")
+def sample_parquet_bytes_with_nulls(sample_parquet_file_with_nulls):
+    """
+    Read sample_parquet_file_with_nulls once so uploads can be served from memory.
+    
+    Args:
+        sample_parquet_file_with_nulls: Fixture providing path to parquet file with nulls
+    
+    Returns:
+        Raw bytes of the parquet file with nulls
+    """
+    return Path(sample_parquet_file_with_nulls).read_bytes()
+
+
 @pytest.fixture
 def sample_customer_record():
     """
@@ -193,12 +309,63 @@ def sample_customer_record_with_nulls():
 @pytest.fixture
 def clear_cache():
     """
-    Clear the customer cache before and after each test.
+    Clear the customer cache and the upload response cache before and after each test.
+    
+    Without resetting the response cache, re-posting bytes seen earlier in the
+    session would return the cached payload and never run the pipeline.
     
     Yields:
-        None, but ensures cache is cleared before and after test
+        None, but ensures caches are cleared before and after test
     """
-    from main import _customer_cache
-    _customer_cache.clear()
+    import main
+    main._customer_df = None
+    main._response_cache.clear()
     yield
-    _customer_cache.clear()
+    main._customer_df = None
+    main._response_cache.clear()
+
+
+@pytest.fixture(scope="session")
+def processed_response(client, sample_upload_body):
+    """
+    Process sample_parquet_file through the endpoint once per session.
+    
+    Args:
+        client: Fixture providing the test client
+        sample_upload_body: Fixture providing the encoded sample upload
+    
+    Returns:
+        Tuple of (response JSON, snapshot of the customer DataFrame the
+        endpoint stored for the recommendation endpoint)
+    """
+    import main
+    
+    body, content_type = sample_upload_body
+    response = client.post(
+        "/api/process-data",
+        content=body,
+        headers={"Content-Type": content_type}
+    )
+    assert response.status_code == 200
+    
+    customer_df_snapshot = main._customer_df.copy()
+    main._customer_df = None
+    return orjson.loads(response.content), customer_df_snapshot
+
+
+@pytest.fixture
+def populated_cache(processed_response, clear_cache):
+    """
+    Restore the customer data stored by processing sample_parquet_file.
+    
+    Args:
+        processed_response: Fixture providing the processed response and snapshot
+        clear_cache: Fixture resetting the customer and response caches around the test
+    
+    Yields:
+        Response JSON from processing sample_parquet_file
+    """
+    import main
+    response_json, customer_df_snapshot = processed_response
+    main._customer_df = customer_df_snapshot
+    yield response_json
@@ -13,67 +13,173 @@ import pytest
 import pandas as pd
 import numpy as np
 from fastapi import status
-from pathlib import Path
 import time
 import io
+import asyncio
+import httpx
+import orjson
+import os
+from concurrent.futures.process import BrokenProcessPool
+import main
+
+# Required fields of ProcessDataResponse, CustomerRecord and SegmentStatistics
+_TOP_LEVEL_FIELDS = frozenset({"status", "message", "data", "total_customers", "segment_statistics"})
+_CUSTOMER_FIELDS = frozenset({
+    "customer_id", "recency", "frequency", "monetary",
+    "median_purchase_days", "churn_ratio", "churn_label",
+    "monetary_log", "cluster_assignment", "segment"
+})
+_SEGMENT_STAT_FIELDS = frozenset({
+    "segment", "high_risk_count", "medium_risk_count",
+    "med_high_ratio", "med_high_monetary_sum"
+})
+
+
+def _json(response):
+    """
+    Parse a response body with orjson.
+    
+    orjson is faster than the stdlib parser and, unlike it, rejects NaN and
+    Infinity, so a NaN leaking into a response fails the test loudly.
+    
+    Args:
+        response: HTTP response from the test client
+    
+    Returns:
+        Parsed JSON body
+    """
+    return orjson.loads(response.content)
+
+@pytest.fixture(scope="module")
+def single_purchase_parquet_bytes():
+    """
+    Build a parquet file containing a single-purchase customer, once per module.
+    
+    Customer 99999 has one purchase on the latest invoice date, giving recency 0
+    and median_purchase_days 0, so its churn_ratio division is 0/0 (NaN) and
+    churn_label is None. Two repeat customers are included so there are enough
+    customers to cluster.
+    
+    Returns:
+        Raw parquet bytes
+    """
+    base_date = pd.Timestamp("2023-01-01")
+    data = {
+        "Invoice": ["INV001", "INV002", "INV003", "INV004", "INV005"],
+        "StockCode": ["PROD001"] * 5,
+        "Description": ["Product 1"] * 5,
+        "Quantity": [1, 2, 2, 3, 3],
+        "InvoiceDate": [base_date + pd.Timedelta(days=d) for d in [80, 10, 40, 20, 80]],
+        "Price": [10.0, 20.0, 20.0, 30.0, 30.0],
+        "Customer ID": [99999.0, 11111.0, 11111.0, 22222.0, 22222.0],
+        "Country": ["UK"] * 5
+    }
+    return pd.DataFrame(data).to_parquet(engine="pyarrow", index=False)
+
+
+@pytest.fixture(scope="module")
+def large_parquet_bytes():
+    """
+    Build a moderately large parquet file in memory, once per module.
+    
+    2000 rows over 100 customers is enough to exercise clustering and
+    aggregation on a non-trivial dataset; columns are built with vectorized
+    numpy/pandas ops rather than per-row Python loops.
+    
+    Returns:
+        Raw parquet bytes
+    """
+    base_date = pd.Timestamp("2023-01-01")
+    n_rows = 2000
+    row = pd.Series(np.arange(n_rows, dtype=np.int64))
+    product = (row % 100).astype(str)
+    
+    data = {
+        "Invoice": "INV" + row.astype(str).str.zfill(5),
+        "StockCode": "PROD" + product.str.zfill(3),
+        "Description": "Product " + product,
+        "Quantity": np.ones(n_rows, dtype=np.int64),
+        "InvoiceDate": base_date + pd.to_timedelta(row % 365, unit="D"),
+        "Price": (10.0 + row % 100).astype(np.float64),
+        "Customer ID": (10000 + row % 100).astype(np.float64),
+        "Country": "UK"
+    }
+    df = pd.DataFrame(data)
+    return df.to_parquet(engine="pyarrow", compression="snappy", index=False)
 
 
 class TestProcessDataEndpoint:
     """Test suite for POST /api/process-data endpoint."""
     
-    def test_valid_parquet_file_upload(self, client, sample_parquet_file):
+    @pytest.mark.xdist_group("no_cache")
+    def test_invalid_file_type_rejection(self, client):
         """
-        Test that a valid parquet file upload is processed successfully.
+        Test that non-parquet files are rejected with 400 error.
         
         Verifies:
-        - Endpoint accepts valid parquet file
-        - Response has correct status code
-        - Response schema matches ProcessDataResponse
-        - Data is returned in correct format
+        - Endpoint rejects non-parquet files
+        - Returns 400 Bad Request
+        - Error message is descriptive
         """
-        with open(sample_parquet_file, "rb") as f:
-            response = client.post(
-                "/api/process-data",
-                files={"file": ("test_data.parquet", f, "application/octet-stream")}
-            )
+        # Upload CSV content instead of parquet
+        response = client.post(
+            "/api/process-data",
+            files={"file": ("test_data.csv", io.BytesIO(b"col1,col2\nval1,val2\n"), "text/csv")}
+        )
         
-        assert response.status_code == status.HTTP_200_OK
-        data = response.json()
-        
-        # Validate response structure
-        assert "status" in data
-        assert "message" in data
-        assert "data" in data
-        assert "total_customers" in data
-        assert "segment_statistics" in data
-        
-        assert data["status"] == "success"
-        assert isinstance(data["data"], list)
-        assert isinstance(data["total_customers"], int)
-        assert isinstance(data["segment_statistics"], list)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "parquet" in _json(response)["detail"].lower()
     
-    def test_invalid_file_type_rejection(self, client, tmp_path):
+    @pytest.mark.xdist_group("no_cache")
+    def test_oversized_file_rejection(self, client, sample_upload_body, monkeypatch):
         """
-        Test that non-parquet files are rejected with 400 error.
+        Test that uploads larger than MAX_UPLOAD_BYTES are rejected with 413.
         
         Verifies:
-        - Endpoint rejects non-parquet files
-        - Returns 400 Bad Request
-        - Error message is descriptive
+        - Oversized uploads return 413 Content Too Large
+        - Pipeline is not run for rejected uploads
         """
-        # Create a CSV file instead of parquet
-        csv_file = tmp_path / "test_data.csv"
-        csv_file.write_text("col1,col2\nval1,val2\n")
+        monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 16)
         
-        with open(csv_file, "rb") as f:
-            response = client.post(
-                "/api/process-data",
-                files={"file": ("test_data.csv", f, "text/csv")}
-            )
+        body, content_type = sample_upload_body
+        response = client.post(
+            "/api/process-data",
+            content=body,
+            headers={"Content-Type": content_type}
+        )
         
-        assert response.status_code == status.HTTP_400_BAD_REQUEST
-        assert "parquet" in response.json()["detail"].lower()
+        assert response.status_code == status.HTTP_413_CONTENT_TOO_LARGE
+        assert "too large" in _json(response)["detail"].lower()
     
+    @pytest.mark.xdist_group("no_cache")
+    def test_oversized_chunked_upload_rejection(self, client, sample_upload_body, monkeypatch):
+        """
+        Test that uploads without a Content-Length header are limited while streaming.
+        
+        Verifies:
+        - Chunked uploads over MAX_UPLOAD_BYTES return 413
+        - The route never sees the upload (pipeline is not run)
+        """
+        monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 16)
+        
+        def fail_pipeline(*args, **kwargs):
+            raise AssertionError("pipeline should not run for a rejected upload")
+        
+        monkeypatch.setattr(main, "_run_pipeline", fail_pipeline)
+        
+        body, content_type = sample_upload_body
+        # A generator body is sent with Transfer-Encoding: chunked, no Content-Length
+        response = client.post(
+            "/api/process-data",
+            content=(body[i:i + 8] for i in range(0, len(body), 8)),
+            headers={"Content-Type": content_type}
+        )
+        
+        assert "content-length" not in response.request.headers
+        assert response.status_code == status.HTTP_413_CONTENT_TOO_LARGE
+        assert "too large" in _json(response)["detail"].lower()
+    
+    @pytest.mark.xdist_group("no_cache")
     def test_missing_file_parameter(self, client):
         """
         Test that missing file parameter returns appropriate error.
@@ -86,7 +192,7 @@ class TestProcessDataEndpoint:
         
         assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
     
-    def test_empty_file_handling(self, client, tmp_path):
+    def test_empty_file_handling(self, client):
         """
         Test that empty parquet file is handled gracefully.
         
@@ -96,19 +202,18 @@ class TestProcessDataEndpoint:
         """
         # Create empty parquet file
         empty_df = pd.DataFrame()
-        empty_file = tmp_path / "empty.parquet"
-        empty_df.to_parquet(empty_file, engine="fastparquet", index=False)
+        empty_bytes = empty_df.to_parquet(engine="pyarrow", index=False)
         
-        with open(empty_file, "rb") as f:
-            response = client.post(
-                "/api/process-data",
-                files={"file": ("empty.parquet", f, "application/octet-stream")}
-            )
+        response = client.post(
+            "/api/process-data",
+            files={"file": ("empty.parquet", io.BytesIO(empty_bytes), "application/octet-stream")}
+        )
         
         # Should either return empty result or error, but not crash
         assert response.status_code in [status.HTTP_200_OK, status.HTTP_500_INTERNAL_SERVER_ERROR]
     
-    def test_null_values_in_data(self, client, sample_parquet_file_with_nulls):
+    @pytest.mark.xdist_group("cache")
+    def test_null_values_in_data(self, client, sample_parquet_bytes_with_nulls):
         """
         Test that null values in input data are handled correctly.
         
@@ -117,107 +222,86 @@ class TestProcessDataEndpoint:
         - Response doesn't contain null customer records
         - No crashes from null handling
         """
-        with open(sample_parquet_file_with_nulls, "rb") as f:
-            response = client.post(
-                "/api/process-data",
-                files={"file": ("test_data_nulls.parquet", f, "application/octet-stream")}
-            )
+        response = client.post(
+            "/api/process-data",
+            files={"file": ("test_data_nulls.parquet", io.BytesIO(sample_parquet_bytes_with_nulls), "application/octet-stream")}
+        )
         
         assert response.status_code == status.HTTP_200_OK
-        data = response.json()
+        data = _json(response)
         
         # All customer records should have valid customer_id
         for record in data["data"]:
-            assert record["customer_id"] is not None
-            assert not pd.isna(record["customer_id"])
+            customer_id = record["customer_id"]
+            assert customer_id is not None
+            assert customer_id == customer_id  # NaN is the only value unequal to itself
     
-    def test_nan_churn_ratio_handling(self, client, tmp_path):
+    @pytest.mark.xdist_group("cache")
+    def test_null_churn_handling(self, client, single_purchase_parquet_bytes, clear_cache):
         """
-        Test that NaN churn_ratio values are converted to None for JSON serialization.
+        Test that NaN churn_ratio / None churn_label survive both endpoints.
         
         Verifies:
-        - NaN churn_ratio values are handled
-        - Infinity churn_ratio values are handled
+        - NaN/inf churn_ratio values are converted to None for JSON serialization
         - Response is valid JSON
+        - Null churn_label doesn't break recommendation generation
         """
-        # Create data that will produce NaN/inf churn_ratio (division by zero)
-        base_date = pd.Timestamp("2023-01-01")
-        data = {
-            "Invoice": ["INV001"],
-            "StockCode": ["PROD001"],
-            "Description": ["Product 1"],
-            "Quantity": [1],
-            "InvoiceDate": [base_date],
-            "Price": [10.0],
-            "Customer ID": [99999.0],
-            "Country": ["UK"]
-        }
-        df = pd.DataFrame(data)
-        parquet_file = tmp_path / "nan_test.parquet"
-        df.to_parquet(parquet_file, engine="fastparquet", index=False)
-        
-        with open(parquet_file, "rb") as f:
-            response = client.post(
-                "/api/process-data",
-                files={"file": ("nan_test.parquet", f, "application/octet-stream")}
-            )
+        response = client.post(
+            "/api/process-data",
+            files={"file": ("single_purchase.parquet", io.BytesIO(single_purchase_parquet_bytes), "application/octet-stream")}
+        )
         
         assert response.status_code == status.HTTP_200_OK
-        data = response.json()
+        data = _json(response)
         
         # Check that NaN/inf values are None in JSON
         for record in data["data"]:
             if record["churn_ratio"] is not None:
                 assert np.isfinite(record["churn_ratio"])
+        
+        # Recommendation should still work with a null churn_label
+        null_label_records = [r for r in data["data"] if r["churn_label"] is None]
+        assert null_label_records
+        for record in null_label_records:
+            customer_id = record["customer_id"]
+            recommendation_response = client.get(f"/api/customer/{customer_id}/recommendation")
+            assert recommendation_response.status_code == status.HTTP_200_OK
+            assert len(_json(recommendation_response)["recommendation"]) > 0
     
-    def test_response_schema_validation(self, client, sample_parquet_file):
+    @pytest.mark.xdist_group("cache")
+    @pytest.mark.parametrize("section, required_fields", [
+        (None, _TOP_LEVEL_FIELDS),
+        ("data", _CUSTOMER_FIELDS),
+        ("segment_statistics", _SEGMENT_STAT_FIELDS)
+    ], ids=["response", "customer_record", "segment_statistics"])
+    def test_response_schema_validation(self, processed_response, section, required_fields):
         """
         Test that response matches ProcessDataResponse schema exactly.
         
         Verifies:
-        - All required fields are present
-        - Field types match schema
+        - All required top-level fields are present with the right types
         - CustomerRecord schema is validated
         - SegmentStatistics schema is validated
         """
-        with open(sample_parquet_file, "rb") as f:
-            response = client.post(
-                "/api/process-data",
-                files={"file": ("test_data.parquet", f, "application/octet-stream")}
-            )
-        
-        assert response.status_code == status.HTTP_200_OK
-        data = response.json()
-        
-        # Validate top-level fields
-        assert isinstance(data["status"], str)
-        assert isinstance(data["message"], str)
-        assert isinstance(data["total_customers"], int)
-        assert isinstance(data["data"], list)
-        assert isinstance(data["segment_statistics"], list)
-        
-        # Validate customer records if present
-        if data["data"]:
-            record = data["data"][0]
-            required_fields = [
-                "customer_id", "recency", "frequency", "monetary",
-                "median_purchase_days", "churn_ratio", "churn_label",
-                "monetary_log", "cluster_assignment", "segment"
-            ]
-            for field in required_fields:
-                assert field in record
-        
-        # Validate segment statistics if present
-        if data["segment_statistics"]:
-            stat = data["segment_statistics"][0]
-            required_fields = [
-                "segment", "high_risk_count", "medium_risk_count",
-                "med_high_ratio", "med_high_monetary_sum"
-            ]
-            for field in required_fields:
-                assert field in stat
+        data, _ = processed_response
+        
+        if section is None:
+            # Validate top-level fields
+            assert data["status"] == "success"
+            assert isinstance(data["message"], str)
+            assert isinstance(data["total_customers"], int)
+            assert isinstance(data["data"], list)
+            assert isinstance(data["segment_statistics"], list)
+            items = [data]
+        else:
+            # Validate the first nested record, if present
+            items = data[section][:1]
+        
+        for item in items:
+            assert required_fields.issubset(item)
     
-    def test_data_sorting(self, client, sample_parquet_file):
+    @pytest.mark.xdist_group("cache")
+    def test_data_sorting(self, processed_response):
         """
         Test that customer data is sorted by churn_ratio (desc) then monetary (desc).
         
@@ -225,29 +309,27 @@ class TestProcessDataEndpoint:
         - Data is sorted correctly
         - NaN values are at the end
         """
-        with open(sample_parquet_file, "rb") as f:
-            response = client.post(
-                "/api/process-data",
-                files={"file": ("test_data.parquet", f, "application/octet-stream")}
-            )
-        
-        assert response.status_code == status.HTTP_200_OK
-        data = response.json()
+        data, _ = processed_response
         
         if len(data["data"]) > 1:
             records = data["data"]
-            for i in range(len(records) - 1):
-                curr = records[i]
-                next_rec = records[i + 1]
-                
-                # If both have churn_ratio, check sorting
-                if curr["churn_ratio"] is not None and next_rec["churn_ratio"] is not None:
-                    assert curr["churn_ratio"] >= next_rec["churn_ratio"]
-                    # If churn_ratio equal, check monetary
-                    if curr["churn_ratio"] == next_rec["churn_ratio"]:
-                        assert curr["monetary"] >= next_rec["monetary"]
+            # Null churn_ratio maps to -inf so those records must come last
+            churn_ratio = np.array([
+                r["churn_ratio"] if r["churn_ratio"] is not None else -np.inf
+                for r in records
+            ])
+            monetary = np.array([r["monetary"] for r in records])
+            
+            # churn_ratio is non-increasing (-inf - -inf is NaN between two nulls)
+            with np.errstate(invalid="ignore"):
+                churn_diff = np.diff(churn_ratio)
+            assert np.all((churn_diff <= 0) | np.isnan(churn_diff))
+            # If churn_ratio equal, monetary is non-increasing
+            ties = churn_diff == 0
+            assert np.all(np.diff(monetary)[ties] <= 0)
     
-    def test_customer_cache_population(self, client, sample_parquet_file, clear_cache):
+    @pytest.mark.xdist_group("cache")
+    def test_customer_cache_population(self, processed_response):
         """
         Test that processed customer data is stored in cache for recommendation endpoint.
         
@@ -255,23 +337,81 @@ class TestProcessDataEndpoint:
         - Customer data is cached after processing
         - Cache can be accessed by recommendation endpoint
         """
-        from main import _customer_cache
-        
-        with open(sample_parquet_file, "rb") as f:
-            response = client.post(
-                "/api/process-data",
-                files={"file": ("test_data.parquet", f, "application/octet-stream")}
-            )
-        
-        assert response.status_code == status.HTTP_200_OK
-        data = response.json()
+        data, customer_df = processed_response
         
         # Check that customers are in cache
         if data["data"]:
             customer_id = data["data"][0]["customer_id"]
-            assert customer_id in _customer_cache
+            assert customer_df is not None
+            assert int(customer_id) in customer_df.index
     
-    def test_large_file_timeout(self, client, tmp_path):
+    @pytest.mark.xdist_group("cache")
+    def test_repeat_upload_served_from_cache(self, client, clear_cache, monkeypatch):
+        """
+        Test that re-uploading an identical file returns the cached response.
+        
+        Verifies:
+        - Second upload of the same bytes does not re-run the pipeline
+        - Cached response matches the original response
+        - Customer cache is repopulated from the cached response
+        """
+        base_date = pd.Timestamp("2023-01-01")
+        data = {
+            "Invoice": ["INV001", "INV002", "INV003", "INV004", "INV005", "INV006"],
+            "StockCode": ["PROD001"] * 6,
+            "Description": ["Product 1"] * 6,
+            "Quantity": [1, 2, 3, 4, 5, 6],
+            "InvoiceDate": [base_date + pd.Timedelta(days=d) for d in [0, 30, 10, 90, 5, 200]],
+            "Price": [10.0, 10.0, 20.0, 20.0, 30.0, 30.0],
+            "Customer ID": [11111.0, 11111.0, 22222.0, 22222.0, 33333.0, 33333.0],
+            "Country": ["UK"] * 6
+        }
+        parquet_bytes = pd.DataFrame(data).to_parquet(engine="pyarrow", index=False)
+        
+        first = client.post(
+            "/api/process-data",
+            files={"file": ("repeat.parquet", io.BytesIO(parquet_bytes), "application/octet-stream")}
+        )
+        assert first.status_code == status.HTTP_200_OK
+        
+        def fail_pipeline(*args, **kwargs):
+            raise AssertionError("pipeline should not run for a cached upload")
+        
+        monkeypatch.setattr(main, "_run_pipeline", fail_pipeline)
+        main._customer_df = None
+        
+        second = client.post(
+            "/api/process-data",
+            files={"file": ("repeat.parquet", io.BytesIO(parquet_bytes), "application/octet-stream")}
+        )
+        
+        assert second.status_code == status.HTTP_200_OK
+        assert _json(second) == _json(first)
+        assert len(main._customer_df) == _json(first)["total_customers"]
+    
+    @pytest.mark.xdist_group("cache")
+    def test_broken_pipeline_pool_recovery(self, client, sample_parquet_bytes, clear_cache):
+        """
+        Test that a dead pipeline worker does not break later uploads.
+        
+        Verifies:
+        - A worker exiting abruptly leaves the pool broken
+        - The next upload replaces the pool and succeeds
+        """
+        broken_pool = main._pipeline_pool
+        with pytest.raises(BrokenProcessPool):
+            broken_pool.submit(os._exit, 1).result()
+        
+        response = client.post(
+            "/api/process-data",
+            files={"file": ("test_data.parquet", io.BytesIO(sample_parquet_bytes), "application/octet-stream")}
+        )
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert main._pipeline_pool is not broken_pool
+    
+    @pytest.mark.xdist_group("cache")
+    def test_large_file_timeout(self, client, large_parquet_bytes):
         """
         Test that large files don't cause timeout issues.
         
@@ -281,87 +421,75 @@ class TestProcessDataEndpoint:
         Verifies:
         - Large files are processed without immediate timeout
         """
-        # Create a moderately large dataset
-        base_date = pd.Timestamp("2023-01-01")
-        n_rows = 10000
-        
-        data = {
-            "Invoice": [f"INV{i:05d}" for i in range(n_rows)],
-            "StockCode": [f"PROD{i%100:03d}" for i in range(n_rows)],
-            "Description": [f"Product {i%100}" for i in range(n_rows)],
-            "Quantity": [1] * n_rows,
-            "InvoiceDate": [base_date + pd.Timedelta(days=i%365) for i in range(n_rows)],
-            "Price": [10.0 + (i % 100)] * n_rows,
-            "Customer ID": [float(10000 + (i % 100)) for i in range(n_rows)],
-            "Country": ["UK"] * n_rows
-        }
-        df = pd.DataFrame(data)
-        large_file = tmp_path / "large_data.parquet"
-        df.to_parquet(large_file, engine="fastparquet", index=False)
-        
-        start_time = time.time()
-        with open(large_file, "rb") as f:
-            response = client.post(
-                "/api/process-data",
-                files={"file": ("large_data.parquet", f, "application/octet-stream")}
-            )
-        elapsed_time = time.time() - start_time
+        start_time = time.perf_counter()
+        response = client.post(
+            "/api/process-data",
+            files={"file": ("large_data.parquet", io.BytesIO(large_parquet_bytes), "application/octet-stream")}
+        )
+        elapsed_time = time.perf_counter() - start_time
         
         # Should complete within reasonable time (adjust threshold as needed)
-        assert elapsed_time < 60  # 60 seconds max
+        assert elapsed_time < 10  # 10 seconds max for 2000 rows
         assert response.status_code in [status.HTTP_200_OK, status.HTTP_500_INTERNAL_SERVER_ERROR]
 
 
 class TestCustomerRecommendationEndpoint:
     """Test suite for GET /api/customer/{customer_id}/recommendation endpoint."""
     
-    def test_valid_customer_id(self, client, sample_parquet_file, clear_cache):
+    @pytest.mark.xdist_group("no_cache")
+    def test_invalid_customer_id_not_found(self, client, clear_cache):
         """
-        Test that valid customer ID returns recommendation.
+        Test that non-existent customer ID returns 404.
         
         Verifies:
-        - Endpoint accepts valid customer_id
-        - Returns customer data and recommendation
-        - Response schema matches CustomerRecommendationResponse
+        - Endpoint returns 404 for missing customer
+        - Error message is descriptive
         """
-        # First process data to populate cache
-        with open(sample_parquet_file, "rb") as f:
-            process_response = client.post(
-                "/api/process-data",
-                files={"file": ("test_data.parquet", f, "application/octet-stream")}
-            )
+        response = client.get("/api/customer/99999.0/recommendation")
         
-        assert process_response.status_code == status.HTTP_200_OK
-        process_data = process_response.json()
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert "not found" in _json(response)["detail"].lower()
+    
+    @pytest.mark.xdist_group("cache")
+    def test_integral_customer_id_lookup(self, client, sample_customer_record, clear_cache):
+        """
+        Test that customer lookup is keyed by the integral customer ID.
         
-        if process_data["data"]:
-            customer_id = process_data["data"][0]["customer_id"]
-            
-            # Get recommendation
-            response = client.get(f"/api/customer/{customer_id}/recommendation")
-            
+        Verifies:
+        - "12345" and "12345.0" resolve to the same cached customer
+        - Non-integral IDs return 404 instead of matching a nearby key
+        """
+        main._customer_df = pd.DataFrame([sample_customer_record], index=[12345])
+        
+        for path_id in ["12345", "12345.0"]:
+            response = client.get(f"/api/customer/{path_id}/recommendation")
             assert response.status_code == status.HTTP_200_OK
-            data = response.json()
-            
-            # Validate response structure
-            assert "customer" in data
-            assert "recommendation" in data
-            assert isinstance(data["recommendation"], str)
-            assert data["customer"]["customer_id"] == customer_id
+            assert _json(response)["customer"]["customer_id"] == 12345.0
+        
+        response = client.get("/api/customer/12345.5/recommendation")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
     
-    def test_invalid_customer_id_not_found(self, client, clear_cache):
+    @pytest.mark.xdist_group("cache")
+    def test_customer_data_dependency_override(self, client, sample_customer_record, clear_cache):
         """
-        Test that non-existent customer ID returns 404.
+        Test that the recommendation endpoint reads customer data via its dependency.
         
         Verifies:
-        - Endpoint returns 404 for missing customer
-        - Error message is descriptive
+        - Overriding get_customer_data supplies the frame used for lookup
+        - Module-level state is not consulted when overridden
         """
-        response = client.get("/api/customer/99999.0/recommendation")
+        override_df = pd.DataFrame([sample_customer_record], index=[12345])
+        main.app.dependency_overrides[main.get_customer_data] = lambda: override_df
+        try:
+            response = client.get("/api/customer/12345/recommendation")
+        finally:
+            main.app.dependency_overrides.clear()
         
-        assert response.status_code == status.HTTP_404_NOT_FOUND
-        assert "not found" in response.json()["detail"].lower()
+        assert main._customer_df is None
+        assert response.status_code == status.HTTP_200_OK
+        assert _json(response)["customer"]["customer_id"] == 12345.0
     
+    @pytest.mark.xdist_group("no_cache")
     def test_customer_id_type_validation(self, client, clear_cache):
         """
         Test that customer_id parameter type is validated.
@@ -379,104 +507,60 @@ class TestCustomerRecommendationEndpoint:
             status.HTTP_422_UNPROCESSABLE_ENTITY  # If validation fails
         ]
     
-    def test_recommendation_for_all_segments(self, client, sample_parquet_file, clear_cache):
+    @pytest.mark.xdist_group("cache")
+    def test_recommendation_for_all_segments(self, populated_cache):
         """
         Test that recommendations are generated for all segment types.
         
         Verifies:
+        - Every segment's customer returns 200
         - Recommendations exist for all segments
         - Recommendation text is not empty
         """
-        # Process data
-        with open(sample_parquet_file, "rb") as f:
-            process_response = client.post(
-                "/api/process-data",
-                files={"file": ("test_data.parquet", f, "application/octet-stream")}
-            )
+        process_data = populated_cache
         
-        assert process_response.status_code == status.HTTP_200_OK
-        process_data = process_response.json()
-        
-        # Get unique segments
-        segments = set()
+        # One representative customer per segment is enough to cover every
+        # recommendation branch
+        per_segment = {}
         for record in process_data["data"]:
-            segments.add(record["segment"])
+            per_segment.setdefault(record["segment"], record)
+        records = list(per_segment.values())
+        
+        # Issue the per-segment GETs concurrently on one event loop
+        async def fetch_all():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+                return await asyncio.gather(*(
+                    async_client.get(f"/api/customer/{record['customer_id']}/recommendation")
+                    for record in records
+                ))
         
         # Test recommendation for each segment
-        for record in process_data["data"]:
-            customer_id = record["customer_id"]
-            response = client.get(f"/api/customer/{customer_id}/recommendation")
-            
-            if response.status_code == status.HTTP_200_OK:
-                data = response.json()
-                assert len(data["recommendation"]) > 0
-                assert data["customer"]["segment"] == record["segment"]
-    
-    def test_recommendation_with_null_churn_label(self, client, tmp_path, clear_cache):
-        """
-        Test that recommendations work even when churn_label is None.
-        
-        Verifies:
-        - Null churn_label doesn't break recommendation generation
-        - Recommendation is still generated
-        """
-        # Create data that produces null churn_label
-        base_date = pd.Timestamp("2023-01-01")
-        data = {
-            "Invoice": ["INV001"],
-            "StockCode": ["PROD001"],
-            "Description": ["Product 1"],
-            "Quantity": [1],
-            "InvoiceDate": [base_date],
-            "Price": [10.0],
-            "Customer ID": [88888.0],
-            "Country": ["UK"]
-        }
-        df = pd.DataFrame(data)
-        parquet_file = tmp_path / "null_churn.parquet"
-        df.to_parquet(parquet_file, engine="fastparquet", index=False)
-        
-        # Process data
-        with open(parquet_file, "rb") as f:
-            process_response = client.post(
-                "/api/process-data",
-                files={"file": ("null_churn.parquet", f, "application/octet-stream")}
-            )
-        
-        if process_response.status_code == status.HTTP_200_OK:
-            process_data = process_response.json()
-            if process_data["data"]:
-                customer_id = process_data["data"][0]["customer_id"]
-                response = client.get(f"/api/customer/{customer_id}/recommendation")
-                
-                # Should still work even with null churn_label
-                assert response.status_code in [status.HTTP_200_OK, status.HTTP_500_INTERNAL_SERVER_ERROR]
+        for record, response in zip(records, asyncio.run(fetch_all())):
+            assert response.status_code == status.HTTP_200_OK
+            data = _json(response)
+            assert len(data["recommendation"]) > 0
+            assert data["customer"]["segment"] == record["segment"]
     
-    def test_response_schema_validation(self, client, sample_parquet_file, clear_cache):
+    @pytest.mark.xdist_group("cache")
+    def test_response_schema_validation(self, client, populated_cache):
         """
-        Test that recommendation response matches CustomerRecommendationResponse schema.
+        Test that a valid customer ID returns a CustomerRecommendationResponse.
         
         Verifies:
+        - Endpoint accepts valid customer_id
         - Response has correct structure
-        - Customer record is valid
+        - Customer record is valid and matches the requested customer
         - Recommendation is a string
         """
-        # Process data
-        with open(sample_parquet_file, "rb") as f:
-            process_response = client.post(
-                "/api/process-data",
-                files={"file": ("test_data.parquet", f, "application/octet-stream")}
-            )
-        
-        assert process_response.status_code == status.HTTP_200_OK
-        process_data = process_response.json()
+        process_data = populated_cache
         
         if process_data["data"]:
             customer_id = process_data["data"][0]["customer_id"]
             response = client.get(f"/api/customer/{customer_id}/recommendation")
             
             assert response.status_code == status.HTTP_200_OK
-            data = response.json()
+            data = _json(response)
             
             # Validate structure
             assert "customer" in data
@@ -484,6 +568,6 @@ class TestCustomerRecommendationEndpoint:
             
             # Validate customer record
             customer = data["customer"]
-            assert "customer_id" in customer
-            assert "segment" in customer
+            assert _CUSTOMER_FIELDS.issubset(customer)
+            assert customer["customer_id"] == customer_id
             assert isinstance(data["recommendation"], str)
@@ -16,19 +16,33 @@ from pathlib import Path
 import tempfile
 import os
 
+from utils import pipelines
 from utils.pipelines import (
     ingest_data,
     transform_data,
     add_features,
     _add_segmentation,
-    _calculate_segment_statistics
+    _calculate_segment_statistics,
+    output_data,
+    run_full_pipeline,
+    INGEST_COLUMNS,
+    INGEST_FILTER,
+    CUSTOMER_COLUMNS,
+    OUTPUT_FILENAMES
 )
 
 
+# Segment names assigned by _add_segmentation() for the default 3 clusters
+_VALID_SEGMENTS = frozenset({
+    "Monthly, High-Value Buyers",
+    "Seasonal Buyers",
+    "Experimental / Hesitant, Lower-Value Buyers"
+})
+
 class TestIngestData:
     """Test suite for ingest_data function."""
     
-    def test_valid_parquet_ingestion(self, sample_parquet_file):
+    def test_valid_parquet_ingestion(self, ingested_sample_df):
         """
         Test that valid parquet file is ingested correctly.
         
@@ -36,7 +50,7 @@ class TestIngestData:
         - Function reads parquet file successfully
         - Returns DataFrame with expected columns
         """
-        df = ingest_data(sample_parquet_file)
+        df = ingested_sample_df
         
         assert isinstance(df, pd.DataFrame)
         assert len(df) > 0
@@ -54,7 +68,25 @@ class TestIngestData:
         """
         with pytest.raises(FileNotFoundError):
             ingest_data("nonexistent_file.parquet")
-    
+
+    def test_column_projection_and_null_filter(self, sample_parquet_file_with_nulls):
+        """
+        Test that columns and filters are pushed down to the parquet reader.
+
+        Verifies:
+        - Only the requested columns are returned
+        - Rows with null Customer ID are filtered out at read time
+        """
+        df = ingest_data(
+            sample_parquet_file_with_nulls,
+            columns=INGEST_COLUMNS,
+            filters=INGEST_FILTER
+        )
+
+        assert list(df.columns) == INGEST_COLUMNS
+        assert len(df) == 4
+        assert df["Customer ID"].notna().all()
+
     def test_invalid_file_format(self, tmp_path):
         """
         Test that invalid file format raises appropriate error.
@@ -73,79 +105,50 @@ class TestIngestData:
 class TestTransformData:
     """Test suite for transform_data function."""
     
-    def test_valid_data_transformation(self, sample_transaction_data):
+    @pytest.mark.parametrize("fixture_name", [
+        "sample_transaction_data",
+        "sample_transaction_data_with_negatives",
+        "sample_transaction_data_with_nulls",
+        "empty_transaction_data"
+    ])
+    def test_transform_invariants(self, request, fixture_name):
         """
-        Test that valid data is transformed correctly.
+        Test that transform_data output satisfies the cleaning invariants.
         
         Verifies:
         - Negative prices/quantities are filtered out
         - Null Customer IDs are removed
+        - No rows are added (empty input gives empty output)
+        - Integer quantities are downcast to int32
         - Returns cleaned DataFrame
         """
-        df = transform_data(sample_transaction_data)
+        df_in = request.getfixturevalue(fixture_name)
+        df = transform_data(df_in)
         
         assert isinstance(df, pd.DataFrame)
+        assert len(df) <= len(df_in)
         # All prices and quantities should be non-negative
         assert (df["Price"] >= 0).all()
         assert (df["Quantity"] >= 0).all()
         # No null Customer IDs
         assert df["Customer ID"].notna().all()
-    
-    def test_negative_values_filtered(self, sample_transaction_data_with_negatives):
-        """
-        Test that negative prices and quantities are filtered out.
-        
-        Verifies:
-        - Negative prices are removed
-        - Negative quantities are removed
-        """
-        df = transform_data(sample_transaction_data_with_negatives)
-        
-        assert (df["Price"] >= 0).all()
-        assert (df["Quantity"] >= 0).all()
-    
-    def test_null_customer_id_filtered(self, sample_transaction_data_with_nulls):
-        """
-        Test that rows with null Customer ID are filtered out.
-        
-        Verifies:
-        - Rows with null Customer ID are removed
-        - Remaining rows have valid Customer IDs
-        """
-        df = transform_data(sample_transaction_data_with_nulls)
-        
-        assert df["Customer ID"].notna().all()
-        # Should have fewer rows than input (one had null Customer ID)
-        assert len(df) <= len(sample_transaction_data_with_nulls)
-    
-    def test_empty_dataframe_handling(self):
-        """
-        Test that empty DataFrame is handled gracefully.
-        
-        Verifies:
-        - Empty DataFrame doesn't crash
-        - Returns empty DataFrame
-        """
-        empty_df = pd.DataFrame(columns=["Invoice", "Price", "Quantity", "Customer ID"])
-        result = transform_data(empty_df)
-        
-        assert isinstance(result, pd.DataFrame)
-        assert len(result) == 0
+        if df_in["Quantity"].dtype.kind in "iu":
+            assert df["Quantity"].dtype == np.int32
 
 
 class TestAddFeatures:
     """Test suite for add_features function."""
     
-    def test_feature_creation(self, sample_transaction_data):
+    def test_feature_creation(self, features_bundle):
         """
         Test that features are created correctly.
         
         Verifies:
         - lineitem_amount is added to full_df
         - invoice_df is created with correct structure
-        - customer_df has RFM metrics
+        - customer_df has RFM metrics, in CUSTOMER_COLUMNS order
         """
-        full_df, invoice_df, customer_df = add_features(sample_transaction_data)
+        full_df, invoice_df, customer_df = features_bundle
         
         # Check full_df
         assert "lineitem_amount" in full_df.columns
@@ -164,8 +167,9 @@ class TestAddFeatures:
         ]
         for col in required_columns:
             assert col in customer_df.columns
+        assert list(customer_df.columns) == CUSTOMER_COLUMNS
     
-    def test_churn_ratio_calculation(self, sample_transaction_data):
+    def test_churn_ratio_calculation(self, features_bundle):
         """
         Test that churn_ratio is calculated correctly.
         
@@ -173,16 +177,18 @@ class TestAddFeatures:
         - churn_ratio = recency / median_purchase_days
         - Handles edge cases (division by zero)
         """
-        full_df, invoice_df, customer_df = add_features(sample_transaction_data)
+        full_df, invoice_df, customer_df = features_bundle
         
-        for _, row in customer_df.iterrows():
-            if pd.notna(row["recency"]) and pd.notna(row["median_purchase_days"]):
-                if row["median_purchase_days"] > 0:
-                    expected_ratio = row["recency"] / row["median_purchase_days"]
-                    if pd.notna(row["churn_ratio"]):
-                        assert abs(row["churn_ratio"] - expected_ratio) < 0.01
+        positive_median = customer_df["median_purchase_days"] > 0
+        expected = (customer_df["recency"] / customer_df["median_purchase_days"]).where(positive_median)
+        mask = expected.notna() & customer_df["churn_ratio"].notna()
+        assert np.isclose(
+            customer_df.loc[mask, "churn_ratio"].to_numpy(),
+            expected[mask].to_numpy(),
+            atol=0.01
+        ).all()
     
-    def test_churn_label_assignment(self, sample_transaction_data):
+    def test_churn_label_assignment(self, features_bundle):
         """
         Test that churn labels are assigned correctly.
         
@@ -192,19 +198,21 @@ class TestAddFeatures:
         - High Risk: churn_ratio >= 2
         - None for invalid ratios
         """
-        full_df, invoice_df, customer_df = add_features(sample_transaction_data)
+        full_df, invoice_df, customer_df = features_bundle
         
-        for _, row in customer_df.iterrows():
-            if pd.notna(row["churn_ratio"]) and np.isfinite(row["churn_ratio"]):
-                ratio = row["churn_ratio"]
-                label = row["churn_label"]
-                
-                if ratio <= 1:
-                    assert label == "Low Risk"
-                elif ratio < 2:
-                    assert label == "Medium Risk"
-                else:
-                    assert label == "High Risk"
+        valid = customer_df.dropna(subset=["churn_ratio"])
+        valid = valid[np.isfinite(valid["churn_ratio"])]
+        
+        # Bins are right-closed, so the middle edge sits just below 2.0 to keep
+        # a ratio of exactly 2 in "High Risk" as the pipeline does
+        expected = pd.cut(
+            valid["churn_ratio"],
+            bins=[-np.inf, 1.0, np.nextafter(2.0, -np.inf), np.inf],
+            labels=["Low Risk", "Medium Risk", "High Risk"],
+            right=True,
+        )
+        
+        assert (valid["churn_label"].astype(str).values == expected.astype(str).values).all()
     
     def test_nan_churn_ratio_handling(self, tmp_path):
         """
@@ -214,17 +222,24 @@ class TestAddFeatures:
         - Division by zero produces None churn_label
         - NaN values don't crash the function
         """
-        # Create data that will cause division by zero
+        # Customer 99999 buys once on the latest date, so recency and
+        # median_purchase_days are both 0 (division by zero); two more
+        # customers are needed to fit the default 3 KMeans clusters
         base_date = pd.Timestamp("2023-01-01")
         data = {
-            "Invoice": ["INV001"],
-            "StockCode": ["PROD001"],
-            "Description": ["Product 1"],
-            "Quantity": [1],
-            "InvoiceDate": [base_date],
-            "Price": [10.0],
-            "Customer ID": [99999.0],
-            "Country": ["UK"]
+            "Invoice": ["INV001", "INV002", "INV003", "INV004"],
+            "StockCode": ["PROD001", "PROD002", "PROD001", "PROD002"],
+            "Description": ["Product 1", "Product 2", "Product 1", "Product 2"],
+            "Quantity": [1, 2, 3, 1],
+            "InvoiceDate": [
+                base_date + pd.Timedelta(days=90),
+                base_date,
+                base_date + pd.Timedelta(days=30),
+                base_date + pd.Timedelta(days=60)
+            ],
+            "Price": [10.0, 5.0, 5.0, 20.0],
+            "Customer ID": [99999.0, 11111.0, 11111.0, 22222.0],
+            "Country": ["UK", "UK", "UK", "UK"]
         }
         df = pd.DataFrame(data)
         
@@ -236,7 +251,7 @@ class TestAddFeatures:
             if pd.isna(row["churn_ratio"]) or not np.isfinite(row["churn_ratio"]):
                 assert row["churn_label"] is None
     
-    def test_segmentation_creation(self, sample_transaction_data):
+    def test_segmentation_creation(self, features_bundle):
         """
         Test that customer segmentation is created.
         
@@ -245,24 +260,18 @@ class TestAddFeatures:
         - Segments are valid names
         - cluster_assignment is an integer
         """
-        full_df, invoice_df, customer_df = add_features(sample_transaction_data)
-        
-        valid_segments = [
-            "Monthly, High-Value Buyers",
-            "Seasonal Buyers",
-            "Experimental / Hesitant, Lower-Value Buyers"
-        ]
+        full_df, invoice_df, customer_df = features_bundle
         
-        for _, row in customer_df.iterrows():
-            assert row["segment"] in valid_segments
-            assert isinstance(row["cluster_assignment"], (int, np.integer))
-            assert pd.notna(row["monetary_log"])
+        bad = ~customer_df["segment"].isin(_VALID_SEGMENTS)
+        assert not bad.any(), customer_df.loc[bad, "segment"].unique()
+        assert customer_df["cluster_assignment"].dtype.kind in "iu"
+        assert customer_df["monetary_log"].notna().all()
 
 
 class TestAddSegmentation:
     """Test suite for _add_segmentation function."""
     
-    def test_segmentation_with_default_clusters(self, sample_transaction_data):
+    def test_segmentation_with_default_clusters(self, features_bundle):
         """
         Test segmentation with default 3 clusters.
         
@@ -270,18 +279,12 @@ class TestAddSegmentation:
         - Segmentation creates 3 clusters
         - Segment names are assigned correctly
         """
-        full_df, invoice_df, customer_df = add_features(sample_transaction_data)
+        full_df, invoice_df, customer_df = features_bundle
         
         segments = customer_df["segment"].unique()
         assert len(segments) <= 3  # May have fewer if not enough customers
         
-        valid_segments = [
-            "Monthly, High-Value Buyers",
-            "Seasonal Buyers",
-            "Experimental / Hesitant, Lower-Value Buyers"
-        ]
-        for seg in segments:
-            assert seg in valid_segments
+        assert set(segments) <= _VALID_SEGMENTS
     
     def test_segmentation_with_custom_clusters(self):
         """
@@ -291,30 +294,53 @@ class TestAddSegmentation:
         - Function accepts custom n_clusters
         - Creates appropriate number of segments
         """
-        # Create minimal data
-        base_date = pd.Timestamp("2023-01-01")
+        # Create minimal data from pre-typed arrays (no per-column dtype inference)
         data = {
-            "customer_id": [1.0, 2.0, 3.0, 4.0, 5.0],
-            "recency": [10, 20, 30, 40, 50],
-            "frequency": [5, 4, 3, 2, 1],
-            "monetary": [1000.0, 800.0, 600.0, 400.0, 200.0],
-            "median_purchase_days": [10.0, 15.0, 20.0, 25.0, 30.0],
-            "churn_ratio": [1.0, 1.33, 1.5, 1.6, 1.67],
-            "churn_label": ["Low Risk", "Medium Risk", "Medium Risk", "Medium Risk", "Medium Risk"]
+            "customer_id": np.array([1.0, 2.0, 3.0, 4.0, 5.0], dtype=np.float64),
+            "recency": np.array([10, 20, 30, 40, 50], dtype=np.int64),
+            "frequency": np.array([5, 4, 3, 2, 1], dtype=np.int64),
+            "monetary": np.array([1000.0, 800.0, 600.0, 400.0, 200.0], dtype=np.float64),
+            "median_purchase_days": np.array([10.0, 15.0, 20.0, 25.0, 30.0], dtype=np.float64),
+            "churn_ratio": np.array([1.0, 1.33, 1.5, 1.6, 1.67], dtype=np.float64),
+            "churn_label": np.array(
+                ["Low Risk", "Medium Risk", "Medium Risk", "Medium Risk", "Medium Risk"], dtype=object
+            )
         }
-        customer_df = pd.DataFrame(data)
+        customer_df = pd.DataFrame(data, copy=False)
         
         result_df = _add_segmentation(customer_df, n_clusters=2)
         
         assert "segment" in result_df.columns
         assert "cluster_assignment" in result_df.columns
         assert len(result_df["cluster_assignment"].unique()) <= 2
+    
+    def test_segmentation_with_minibatch_kmeans(self, monkeypatch):
+        """
+        Test segmentation above the MiniBatchKMeans threshold.
+        
+        Verifies:
+        - Large customer sets are clustered without errors
+        - Every customer gets one of the default segment names
+        """
+        monkeypatch.setattr(pipelines, "MINIBATCH_KMEANS_THRESHOLD", 10)
+        
+        rng = np.random.default_rng(0)
+        customer_df = pd.DataFrame({
+            "recency": rng.integers(0, 365, 50),
+            "frequency": rng.integers(1, 20, 50),
+            "monetary": rng.gamma(2.0, 500.0, 50)
+        })
+        
+        result_df = _add_segmentation(customer_df)
+        
+        assert len(result_df) == 50
+        assert result_df["segment"].isin(_VALID_SEGMENTS).all()
 
 
 class TestCalculateSegmentStatistics:
     """Test suite for _calculate_segment_statistics function."""
     
-    def test_statistics_calculation(self, sample_transaction_data):
+    def test_statistics_calculation(self, features_bundle):
         """
         Test that segment statistics are calculated correctly.
         
@@ -323,7 +349,7 @@ class TestCalculateSegmentStatistics:
         - Total row is included
         - Counts and ratios are correct
         """
-        full_df, invoice_df, customer_df = add_features(sample_transaction_data)
+        full_df, invoice_df, customer_df = features_bundle
         
         stats = _calculate_segment_statistics(customer_df)
         
@@ -331,24 +357,23 @@ class TestCalculateSegmentStatistics:
         assert len(stats) > 0
         
         # Check that Total row exists
-        total_row = None
-        for stat in stats:
-            if stat.segment == "Total":
-                total_row = stat
-                break
+        by_segment = {stat.segment: stat for stat in stats}
+        total_row = by_segment.get("Total")
         
         assert total_row is not None
         
         # Validate statistics structure
-        for stat in stats:
-            assert isinstance(stat.segment, str)
-            assert isinstance(stat.high_risk_count, int)
-            assert isinstance(stat.medium_risk_count, int)
-            assert isinstance(stat.med_high_ratio, float)
-            assert isinstance(stat.med_high_monetary_sum, float)
-            assert 0 <= stat.med_high_ratio <= 1
+        assert all(
+            isinstance(stat.segment, str)
+            and isinstance(stat.high_risk_count, int)
+            and isinstance(stat.medium_risk_count, int)
+            and isinstance(stat.med_high_ratio, float)
+            and isinstance(stat.med_high_monetary_sum, float)
+            and 0 <= stat.med_high_ratio <= 1
+            for stat in stats
+        )
     
-    def test_statistics_with_null_churn_labels(self, tmp_path):
+    def test_statistics_with_null_churn_labels(self):
         """
         Test that statistics handle null churn_labels correctly.
         
@@ -356,24 +381,20 @@ class TestCalculateSegmentStatistics:
         - Null churn_labels don't break statistics
         - Counts are accurate
         """
-        # Create data with null churn_labels
-        base_date = pd.Timestamp("2023-01-01")
-        data = {
-            "Invoice": ["INV001", "INV002"],
-            "StockCode": ["PROD001", "PROD002"],
-            "Description": ["Product 1", "Product 2"],
-            "Quantity": [1, 1],
-            "InvoiceDate": [base_date, base_date + pd.Timedelta(days=30)],
-            "Price": [10.0, 20.0],
-            "Customer ID": [11111.0, 22222.0],
-            "Country": ["UK", "UK"]
-        }
-        df = pd.DataFrame(data)
-        
-        full_df, invoice_df, customer_df = add_features(df)
-        
-        # Manually set some churn_labels to None to test
-        customer_df.loc[customer_df.index[0], "churn_label"] = None
+        # Build the customer frame directly; the full pipeline is covered by
+        # the add_features tests above
+        customer_df = pd.DataFrame({
+            "customer_id": [11111.0, 22222.0],
+            "recency": [0, 0],
+            "frequency": [1, 1],
+            "monetary": [10.0, 20.0],
+            "median_purchase_days": [0.0, 0.0],
+            "churn_ratio": [np.nan, np.nan],
+            "churn_label": [None, "Low Risk"],
+            "monetary_log": [2.3, 3.0],
+            "cluster_assignment": [0, 1],
+            "segment": ["Seasonal Buyers", "Monthly, High-Value Buyers"]
+        })
         
         stats = _calculate_segment_statistics(customer_df)
         
@@ -411,3 +432,66 @@ class TestCalculateSegmentStatistics:
                 assert stat.high_risk_count == 0
                 assert stat.medium_risk_count == 0
                 assert stat.med_high_ratio == 0.0
+
+
+class TestOutputData:
+    """Test suite for output_data function."""
+    
+    def test_parquet_round_trip(self, features_bundle, tmp_path):
+        """
+        Test that output_data writes Parquet files that read back unchanged.
+        
+        Verifies:
+        - All three Parquet files are written
+        - Each file reads back equal to its DataFrame (index dropped)
+        """
+        output_data(*features_bundle, output_dir=str(tmp_path))
+        
+        for name, df in zip(OUTPUT_FILENAMES, features_bundle):
+            written = pd.read_parquet(tmp_path / name, engine="pyarrow")
+            pd.testing.assert_frame_equal(written, df.reset_index(drop=True))
+
+
+class TestRunFullPipeline:
+    """Test suite for run_full_pipeline function."""
+    
+    def test_output_cache_hit_and_invalidation(self, sample_transaction_data, tmp_path, monkeypatch):
+        """
+        Test that unchanged inputs reuse the outputs and changes re-run the pipeline.
+        
+        Verifies:
+        - A second run on the same file reads the outputs back (no add_features call)
+        - Cached frames match the computed ones
+        - Touching the source file re-runs the pipeline
+        - A deleted output file is regenerated
+        """
+        source = tmp_path / "source.parquet"
+        sample_transaction_data.to_parquet(source, engine="pyarrow", index=False)
+        output_dir = tmp_path / "processed"
+        
+        calls = []
+        
+        def counting_add_features(full_df):
+            calls.append(len(full_df))
+            return add_features(full_df)
+        
+        monkeypatch.setattr(pipelines, "add_features", counting_add_features)
+        
+        first = run_full_pipeline(str(source), str(output_dir))
+        second = run_full_pipeline(str(source), str(output_dir))
+        
+        assert len(calls) == 1
+        for computed, cached in zip(first, second):
+            pd.testing.assert_frame_equal(computed.reset_index(drop=True), cached)
+        
+        # Bump the source mtime: the cache key changes
+        stat = os.stat(source)
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        run_full_pipeline(str(source), str(output_dir))
+        assert len(calls) == 2
+        
+        # Remove one output: the run must regenerate it
+        (output_dir / OUTPUT_FILENAMES[0]).unlink()
+        run_full_pipeline(str(source), str(output_dir))
+        assert len(calls) == 3
+        assert all((output_dir / name).exists() for name in OUTPUT_FILENAMES)
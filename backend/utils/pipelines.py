@@ -5,25 +5,76 @@ This module contains functions for ingesting, transforming, and processing
 retail transaction data to create customer segmentation models.
 """
 
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import sklearn
 from pathlib import Path
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from schemas import SegmentStatistics
-from typing import List
+from typing import BinaryIO, List, Optional, Union
 
 
-def ingest_data(data_path: str) -> pd.DataFrame:
+# Columns read by transform_data() and add_features(); the remaining raw
+# columns (Invoice, StockCode, Description, Country) are never used downstream
+INGEST_COLUMNS = ["Customer ID", "InvoiceDate", "Quantity", "Price"]
+
+# Row filter pushed down to the parquet reader: transform_data() drops
+# transactions without a customer anyway
+INGEST_FILTER = pc.field("Customer ID").is_valid()
+
+# Customer count above which _add_segmentation() switches from full-batch KMeans
+# to MiniBatchKMeans; smaller inputs keep the exact KMeans cluster assignments
+MINIBATCH_KMEANS_THRESHOLD = 50_000
+
+# Files written by output_data(), in run_full_pipeline() return order
+OUTPUT_FILENAMES = ("full_df.parquet", "invoice_df.parquet", "customer_df.parquet")
+
+# Manifest written next to the outputs by run_full_pipeline() so unchanged
+# inputs can reuse them
+PIPELINE_CACHE_MANIFEST = ".pipeline_cache.json"
+
+# Customer-level columns returned by add_features(), in CustomerRecord schema order
+CUSTOMER_COLUMNS = [
+    "customer_id",
+    "recency",
+    "frequency",
+    "monetary",
+    "median_purchase_days",
+    "churn_ratio",
+    "churn_label",
+    "monetary_log",
+    "cluster_assignment",
+    "segment"
+]
+
+
+def ingest_data(
+    data_path: Union[str, Path, BinaryIO],
+    columns: Optional[List[str]] = None,
+    filters: Optional[pc.Expression] = None
+) -> pd.DataFrame:
     """
     Load raw transaction data from parquet file.
     
     Args:
-        data_path: Path to the parquet file containing raw transaction data.
-                   Should be relative to the backend directory or absolute path.
+        data_path: Path to the parquet file containing raw transaction data
+                   (relative to the backend directory or absolute), or a
+                   seekable binary file-like object such as an upload stream.
+        columns: Optional subset of columns to read (e.g. INGEST_COLUMNS).
+                 Unread columns are never decompressed. Defaults to all columns.
+        filters: Optional pyarrow row filter applied while reading
+                 (e.g. INGEST_FILTER). Defaults to no filtering.
     
     Returns:
-        DataFrame containing raw transaction data with columns:
+        DataFrame containing raw transaction data with columns (or the
+        requested subset of them):
         - Invoice: Invoice number
         - StockCode: Product stock code
         - Description: Product description
@@ -33,7 +84,8 @@ def ingest_data(data_path: str) -> pd.DataFrame:
         - Customer ID: Customer identifier
         - Country: Country of purchase
     """
-    raw_df = pd.read_parquet(data_path, engine="fastparquet")
+    table = pq.read_table(data_path, columns=columns, filters=filters, use_threads=True)
+    raw_df = table.to_pandas(self_destruct=True, split_blocks=True, use_threads=True)
     return raw_df
 
 
@@ -42,7 +94,7 @@ def transform_data(raw_df: pd.DataFrame) -> pd.DataFrame:
     Clean and transform raw transaction data.
     
     Removes invalid records (negative prices/quantities) and records
-    with missing customer IDs.
+    with missing customer IDs, and downcasts integer Quantity to int32.
     
     Args:
         raw_df: Raw transaction DataFrame from ingest_data()
@@ -56,6 +108,12 @@ def transform_data(raw_df: pd.DataFrame) -> pd.DataFrame:
         (raw_df["Price"] >= 0) & (raw_df["Quantity"] >= 0)
     ].dropna(subset=["Customer ID"])
     
+    # Quantities are small non-negative counts; int32 halves the bytes every
+    # later pass reads (Price and Customer ID stay float64 for exact totals/IDs)
+    quantity = full_df["Quantity"]
+    if quantity.dtype.kind in "iu" and (quantity.empty or quantity.max() <= np.iinfo(np.int32).max):
+        full_df["Quantity"] = quantity.astype(np.int32)
+    
     return full_df
 
 
@@ -73,11 +131,14 @@ def add_features(full_df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.
         Tuple of three DataFrames:
         - full_df: Original DataFrame with added lineitem_amount column
         - invoice_df: Invoice-level aggregations with interpurchase days
-        - customer_df: Customer-level aggregations with RFM metrics and segments
+        - customer_df: Customer-level aggregations with RFM metrics and segments,
+          with columns exactly CUSTOMER_COLUMNS in that order
     """
-    # Add line item amount feature
-    full_df = full_df.copy()
-    full_df["lineitem_amount"] = full_df["Quantity"] * full_df["Price"]
+    # Add line item amount feature, multiplying the raw arrays directly to
+    # skip pandas' index alignment and operator dispatch. The shallow copy
+    # shares the existing columns and only keeps the caller's frame unchanged
+    full_df = full_df.copy(deep=False)
+    full_df["lineitem_amount"] = full_df["Quantity"].to_numpy() * full_df["Price"].to_numpy()
     
     # Get max date as reference for 'today'
     max_date = full_df["InvoiceDate"].max().normalize()
@@ -86,31 +147,37 @@ def add_features(full_df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.
     invoice_df = (
         full_df
         .assign(InvoiceDate=full_df["InvoiceDate"].dt.normalize())
-        .groupby(["Customer ID", "InvoiceDate"], as_index=False)
+        .groupby(["Customer ID", "InvoiceDate"], as_index=False, sort=False)
         .agg(
             monetary=("lineitem_amount", "sum")
         )
     )
     
-    # Sort by customer, then date to help calculate interpurchase days
-    invoice_df = invoice_df.sort_values(["Customer ID", "InvoiceDate"])
-    
-    # Calculate days between purchases
-    invoice_df["days_between_purchases"] = (
-        invoice_df
-        .groupby("Customer ID")["InvoiceDate"]
-        .diff()
-        .dt.days
+    # Sort by customer, then date to help calculate interpurchase days (the
+    # groupby above skips its own sort since this one is needed anyway)
+    invoice_df = invoice_df.sort_values(["Customer ID", "InvoiceDate"], ignore_index=True)
+    
+    # Calculate days between purchases: on the sorted frame this is a plain
+    # consecutive difference, blanked wherever a new customer's rows begin
+    customer_ids = invoice_df["Customer ID"].to_numpy()
+    invoice_days = invoice_df["InvoiceDate"].to_numpy(dtype="datetime64[D]").astype(np.int64)
+    days_between = np.full(len(invoice_df), np.nan)
+    days_between[1:] = np.where(
+        customer_ids[1:] == customer_ids[:-1],
+        invoice_days[1:] - invoice_days[:-1],
+        np.nan
     )
+    invoice_df["days_between_purchases"] = days_between
     
     # Create customer-level DataFrame with RFM metrics
     customer_df = (
         invoice_df
-        .groupby("Customer ID")
+        # Rows are already in customer order, so first appearance == sorted
+        .groupby("Customer ID", sort=False)
         .agg(
             customer_id=("Customer ID", "first"),
-            # Recency: days since most recent invoice
-            recency=("InvoiceDate", lambda x: (max_date - x.max().normalize()).days),
+            # Most recent invoice date, converted to recency below
+            recency=("InvoiceDate", "max"),
             # Frequency: number of invoices
             frequency=("InvoiceDate", "count"),
             # Monetary: total spend
@@ -121,6 +188,10 @@ def add_features(full_df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.
         .reset_index(drop=True)
     )
     
+    # Recency: days since most recent invoice, as one vectorized subtraction
+    # instead of a Python lambda per customer (invoice dates are already normalized)
+    customer_df["recency"] = (max_date - customer_df["recency"]).dt.days
+    
     # Fill NaN median_purchase_days with recency (for customers with only one purchase)
     customer_df["median_purchase_days"] = (
         customer_df["median_purchase_days"]
@@ -130,19 +201,16 @@ def add_features(full_df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.
     # Add churn ratio feature
     customer_df["churn_ratio"] = customer_df["recency"] / customer_df["median_purchase_days"]
     
-    # Add churn label based on churn_ratio
-    def assign_churn_label(ratio):
-        """Assign churn risk label based on churn ratio."""
-        if pd.isna(ratio) or not np.isfinite(ratio):
-            return None
-        if ratio <= 1:
-            return "Low Risk"
-        elif ratio < 2:
-            return "Medium Risk"
-        else:  # ratio >= 2
-            return "High Risk"
-    
-    customer_df["churn_label"] = customer_df["churn_ratio"].apply(assign_churn_label)
+    # Add churn label based on churn_ratio in one vectorized pass:
+    # <= 1 is Low Risk, < 2 is Medium Risk, >= 2 is High Risk, NaN/inf is None
+    ratio = customer_df["churn_ratio"].to_numpy(dtype=float)
+    churn_label = np.select(
+        [ratio <= 1, ratio < 2],
+        ["Low Risk", "Medium Risk"],
+        default="High Risk"
+    ).astype(object)
+    churn_label[~np.isfinite(ratio)] = None
+    customer_df["churn_label"] = churn_label
     
     # Add customer segmentation using KMeans clustering
     customer_df = _add_segmentation(customer_df)
@@ -155,7 +223,8 @@ def _add_segmentation(customer_df: pd.DataFrame, n_clusters: int = 3) -> pd.Data
     Add customer segmentation using KMeans clustering on RFM features.
     
     Clusters customers based on normalized Recency, Frequency, and Monetary
-    (log-transformed) values, then assigns segment names.
+    (log-transformed) values, then assigns segment names. Inputs with more than
+    MINIBATCH_KMEANS_THRESHOLD customers are clustered with MiniBatchKMeans.
     
     Args:
         customer_df: Customer-level DataFrame with RFM metrics
@@ -170,41 +239,52 @@ def _add_segmentation(customer_df: pd.DataFrame, n_clusters: int = 3) -> pd.Data
     # Log transform monetary for clustering (to handle skewness)
     customer_df['monetary_log'] = np.log1p(customer_df['monetary'])
     
-    # Prepare features for clustering
-    kmeans_df = customer_df[["recency", "frequency", "monetary_log"]]
-    
-    # Normalize the data
-    scaler = StandardScaler()
-    X = scaler.fit_transform(kmeans_df)
-    
-    # Fit KMeans clustering
-    kmeans = KMeans(
-        n_clusters=n_clusters,
-        random_state=42,
-        n_init=10
-    )
+    # Prepare features for clustering as one float32 array: half the memory
+    # traffic through KMeans' distance computations
+    X = customer_df[["recency", "frequency", "monetary_log"]].to_numpy(dtype=np.float32)
+    
+    # Normalize the data in place (X is already a fresh array)
+    scaler = StandardScaler(copy=False)
+    X = scaler.fit_transform(X)
+    
+    # Fit KMeans clustering; mini-batch updates for large customer sets, where
+    # ten full Lloyd runs dominate the pipeline's CPU time
+    if len(customer_df) > MINIBATCH_KMEANS_THRESHOLD:
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            random_state=42,
+            batch_size=4096,
+            n_init=3,
+            max_iter=100
+        )
+    else:
+        kmeans = KMeans(
+            n_clusters=n_clusters,
+            random_state=42,
+            n_init=10
+        )
     
     result = kmeans.fit_predict(X)
     
     # Add cluster assignments
     customer_df["cluster_assignment"] = result
     
-    # Map clusters to segment names
-    cluster_map = {
-        0: 'Seasonal Buyers',
-        1: 'Monthly, High-Value Buyers',
-        2: 'Experimental / Hesitant, Lower-Value Buyers'
-    }
-    
-    # Handle case where n_clusters might be different
+    # Segment names indexed by cluster number; for other cluster counts, use
+    # generic names
     if n_clusters == 3:
-        customer_df['segment'] = customer_df['cluster_assignment'].map(cluster_map)
+        segment_names = np.array([
+            'Seasonal Buyers',
+            'Monthly, High-Value Buyers',
+            'Experimental / Hesitant, Lower-Value Buyers'
+        ], dtype=object)
     else:
-        # For other cluster counts, use generic names
-        customer_df['segment'] = customer_df['cluster_assignment'].apply(
-            lambda x: f'Segment {x}'
+        segment_names = np.array(
+            [f'Segment {cluster}' for cluster in range(n_clusters)], dtype=object
         )
     
+    # Map clusters to segment names with one array take instead of a per-row lookup
+    customer_df['segment'] = segment_names[result]
+    
     return customer_df
 
 
@@ -215,27 +295,100 @@ def output_data(
     output_dir: str = "data/processed"
 ) -> None:
     """
-    Save processed DataFrames to CSV files.
+    Save processed DataFrames to Snappy-compressed Parquet files.
     
     Args:
         full_df: Full transaction DataFrame with features
         invoice_df: Invoice-level aggregated DataFrame
         customer_df: Customer-level aggregated DataFrame with segments
         output_dir: Directory path (relative to backend or absolute) where
-                   CSV files will be saved. Defaults to "data/processed".
+                   Parquet files will be saved. Defaults to "data/processed".
     """
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
     
-    # Save to CSV files
-    customer_df.to_csv(output_path / "customer_df.csv", index=False)
-    invoice_df.to_csv(output_path / "invoice_df.csv", index=False)
-    full_df.to_csv(output_path / "full_df.csv", index=False)
+    # Save to Parquet files (read back with pd.read_parquet). The writes are
+    # independent and pyarrow encodes/compresses outside the GIL, so they
+    # overlap on threads
+    outputs = [
+        (customer_df, output_path / "customer_df.parquet"),
+        (invoice_df, output_path / "invoice_df.parquet"),
+        (full_df, output_path / "full_df.parquet")
+    ]
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        futures = [
+            executor.submit(df.to_parquet, path, engine="pyarrow", compression="snappy", index=False)
+            for df, path in outputs
+        ]
+        for future in futures:
+            future.result()
+
+
+def _pipeline_cache_key(data_path: Union[str, Path]) -> str:
+    """
+    Compute the cache key for a pipeline run on a given input file.
+    
+    The key covers the resolved input path plus its modification time and size,
+    salted with the source of this module and the pandas/scikit-learn versions,
+    so editing the parquet file or the pipeline code invalidates the outputs.
+    
+    Args:
+        data_path: Path to the input parquet file
+    
+    Returns:
+        Hex digest identifying the input file and pipeline version
+    """
+    stat = os.stat(data_path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{Path(data_path).resolve()}|{stat.st_mtime_ns}|{stat.st_size}".encode())
+    digest.update(f"{pd.__version__}|{sklearn.__version__}".encode())
+    digest.update(Path(__file__).read_bytes())
+    return digest.hexdigest()
+
+
+def _output_file_state(path: Path) -> List[int]:
+    """Return [st_mtime_ns, st_size] of an output file, used to detect outdated outputs."""
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _load_cached_outputs(
+    output_path: Path,
+    cache_key: str
+) -> Optional[tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    """
+    Load the output_data() files if they were produced for cache_key.
+    
+    Args:
+        output_path: Directory holding the outputs and the cache manifest
+        cache_key: Key from _pipeline_cache_key() for the current input
+    
+    Returns:
+        Tuple of (full_df, invoice_df, customer_df), or None if the manifest is
+        missing or stale, or any output file is missing or was modified since
+    """
+    try:
+        manifest = json.loads((output_path / PIPELINE_CACHE_MANIFEST).read_text())
+        if manifest.get("key") != cache_key:
+            return None
+        if any(
+            _output_file_state(output_path / name) != manifest["files"].get(name)
+            for name in OUTPUT_FILENAMES
+        ):
+            return None
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None
+    
+    full_df, invoice_df, customer_df = (
+        pd.read_parquet(output_path / name, engine="pyarrow") for name in OUTPUT_FILENAMES
+    )
+    return full_df, invoice_df, customer_df
 
 
 def run_full_pipeline(
     data_path: str,
-    output_dir: str = "data/processed"
+    output_dir: str = "data/processed",
+    use_cache: bool = True
 ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Run the complete data processing pipeline from ingestion to output.
@@ -244,15 +397,31 @@ def run_full_pipeline(
     1. Ingest raw data
     2. Transform and clean data
     3. Add features and create aggregations
-    4. Save results to CSV files
+    4. Save results to Parquet files
+    
+    The output files double as the cache: a manifest next to them records the
+    input's cache key (path, modification time, size and pipeline version) and
+    the state of each output file. A later run with the same key and untouched
+    outputs reads them back instead of re-running the pipeline; anything else
+    (changed input or code, missing or modified outputs) re-runs all steps.
+    Frames read from the cache have a default RangeIndex.
     
     Args:
         data_path: Path to the input parquet file
-        output_dir: Directory path for output CSV files
+        output_dir: Directory path for output Parquet files
+        use_cache: Whether to reuse up-to-date outputs (default: True)
     
     Returns:
         Tuple of (full_df, invoice_df, customer_df) DataFrames
     """
+    output_path = Path(output_dir)
+    cache_key = _pipeline_cache_key(data_path)
+    
+    if use_cache:
+        cached = _load_cached_outputs(output_path, cache_key)
+        if cached is not None:
+            return cached
+    
     # Step 1: Ingest data
     raw_df = ingest_data(data_path)
     
@@ -265,6 +434,16 @@ def run_full_pipeline(
     # Step 4: Output data
     output_data(full_df, invoice_df, customer_df, output_dir)
     
+    # Record which input the outputs belong to; written last (and atomically)
+    # so an interrupted run never leaves a manifest for partial outputs
+    manifest = {
+        "key": cache_key,
+        "files": {name: _output_file_state(output_path / name) for name in OUTPUT_FILENAMES}
+    }
+    manifest_tmp = output_path / f"{PIPELINE_CACHE_MANIFEST}.tmp"
+    manifest_tmp.write_text(json.dumps(manifest))
+    os.replace(manifest_tmp, output_path / PIPELINE_CACHE_MANIFEST)
+    
     return full_df, invoice_df, customer_df
 
 def _calculate_segment_statistics(customer_df: pd.DataFrame) -> List[SegmentStatistics]:
@@ -275,52 +454,60 @@ def _calculate_segment_statistics(customer_df: pd.DataFrame) -> List[SegmentStat
         customer_df: DataFrame with customer data including segment and churn_label
     
     Returns:
-        List of SegmentStatistics objects, one per segment plus a "Total" row
+        List of SegmentStatistics objects, one per segment plus a "Total" row.
+        Field values are cast to their schema types here, so the models are
+        built with model_construct() and skip re-validation.
     """
     stats_list = []
     
-    # Get unique segments
+    # Get unique segments (in order of first appearance)
     segments = customer_df['segment'].unique().tolist()
     
+    # Flag Medium/High risk customers once, then aggregate every segment in a
+    # single groupby pass instead of re-filtering the frame per segment
+    is_high = customer_df['churn_label'].eq('High Risk')
+    is_medium = customer_df['churn_label'].eq('Medium Risk')
+    med_high_monetary = customer_df['monetary'].where(is_high | is_medium, 0.0)
+    
+    segment_df = (
+        pd.DataFrame({
+            'segment': customer_df['segment'],
+            'is_high': is_high,
+            'is_medium': is_medium,
+            'med_high_monetary': med_high_monetary
+        })
+        .groupby('segment', sort=False, observed=True)
+        .agg(
+            total_customers=('is_high', 'size'),
+            high_risk_count=('is_high', 'sum'),
+            medium_risk_count=('is_medium', 'sum'),
+            med_high_monetary_sum=('med_high_monetary', 'sum')
+        )
+        .reindex(segments)
+    )
+    
     # Calculate statistics for each segment
-    for segment in segments:
-        segment_df = customer_df[customer_df['segment'] == segment]
-        total_customers = len(segment_df)
-        
-        # Count high and medium risk customers
-        high_risk_count = len(segment_df[segment_df['churn_label'] == 'High Risk'])
-        medium_risk_count = len(segment_df[segment_df['churn_label'] == 'Medium Risk'])
-        
+    for segment, row in zip(segments, segment_df.itertuples(index=False)):
         # Calculate ratio of Med/High to total
-        med_high_count = high_risk_count + medium_risk_count
-        med_high_ratio = med_high_count / total_customers if total_customers > 0 else 0.0
+        med_high_count = row.high_risk_count + row.medium_risk_count
+        med_high_ratio = med_high_count / row.total_customers if row.total_customers > 0 else 0.0
         
-        # Calculate total monetary sum of Med/High risk customers
-        med_high_customers = segment_df[
-            segment_df['churn_label'].isin(['Medium Risk', 'High Risk'])
-        ]
-        med_high_monetary_sum = med_high_customers['monetary'].sum() if len(med_high_customers) > 0 else 0.0
-        
-        stats_list.append(SegmentStatistics(
+        stats_list.append(SegmentStatistics.model_construct(
             segment=segment,
-            high_risk_count=int(high_risk_count),
-            medium_risk_count=int(medium_risk_count),
+            high_risk_count=int(row.high_risk_count),
+            medium_risk_count=int(row.medium_risk_count),
             med_high_ratio=float(med_high_ratio),
-            med_high_monetary_sum=float(med_high_monetary_sum)
+            med_high_monetary_sum=float(row.med_high_monetary_sum)
         ))
     
     # Calculate total row
     total_customers = len(customer_df)
-    total_high_risk = len(customer_df[customer_df['churn_label'] == 'High Risk'])
-    total_medium_risk = len(customer_df[customer_df['churn_label'] == 'Medium Risk'])
+    total_high_risk = int(is_high.sum())
+    total_medium_risk = int(is_medium.sum())
     total_med_high_ratio = (total_high_risk + total_medium_risk) / total_customers if total_customers > 0 else 0.0
+    total_med_high_monetary = med_high_monetary.sum()
     
-    total_med_high_customers = customer_df[
-        customer_df['churn_label'].isin(['Medium Risk', 'High Risk'])
-    ]
-    total_med_high_monetary = total_med_high_customers['monetary'].sum() if len(total_med_high_customers) > 0 else 0.0
-    
-    stats_list.append(SegmentStatistics(
+    stats_list.append(SegmentStatistics.model_construct(
         segment="Total",
         high_risk_count=int(total_high_risk),
         medium_risk_count=int(total_medium_risk),
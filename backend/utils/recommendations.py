@@ -1,45 +1,64 @@
 from schemas import CustomerRecord
+from typing import Callable, Dict
 
-def _generate_recommendation(customer: CustomerRecord) -> str:
-    """
-    Generate recommendation text based on customer segment and churn risk.
-    
-    Args:
-        customer: CustomerRecord with all customer data
-    
-    Returns:
-        Text recommendation string
-    """
-    segment = customer.segment
-    churn_label = customer.churn_label
-    frequency_last_year = customer.frequency
-    annual_value = customer.monetary
-    days_since_last_purchase = customer.recency
-    
-    ## Recommendations currently static, but would incorporate language model endpoint to adapt/personalize to customer data points if time
-    
-    if segment == "Monthly, High-Value Buyers":
-        return f"""
+
+## Recommendations currently static, but would incorporate language model endpoint to adapt/personalize to customer data points if time
+
+def _monthly_high_value_recommendation(frequency_last_year: int, annual_value: float, days_since_last_purchase: int) -> str:
+    """Recommendation text for the "Monthly, High-Value Buyers" segment."""
+    return f"""
         (1) Reward consistency and loyalty. This customer purchased {frequency_last_year} times in the past year and generates ${annual_value} annually. Introduce tiered rewards, priority access to new products, or volume-based incentives to reinforce their regular buying behavior.
 
         (2) Encourage larger or more strategic orders. With their last purchase occurring {days_since_last_purchase} days ago, prompt reorders using bulk discounts, personalized reorder reminders, or exclusive bundles aligned to their purchase history.
 
         (3)Protect against churn despite high value. Even high-performing customers can lapse. Assign a dedicated account touchpoint or proactive outreach if recency exceeds expected monthly cadence to preserve long-term value."""
-    
-    elif segment == "Seasonal Buyers":
-        return f"""
+
+
+def _seasonal_recommendation(frequency_last_year: int, annual_value: float, days_since_last_purchase: int) -> str:
+    """Recommendation text for the "Seasonal Buyers" segment."""
+    return f"""
         (1) Time outreach around known buying cycles. This customer last purchased {days_since_last_purchase} days ago, indicating a seasonal pattern. Use historical purchase timing to trigger campaigns just before their typical buying window.
 
         (2)Increase value during active periods. With {frequency_last_year} purchases and ${annual_value} annual spend, focus on maximizing order size during peak seasons through bundles, add-ons, or limited-time promotions.
 
         (3)Maintain light engagement off-season. Avoid over-marketing during inactive periods. Instead, use low-touch content (new arrivals, planning tools, early previews) to stay top-of-mind without driving fatigue."""
-    
-    else:  # Experimental / Hesitant, Lower-Value Buyers
-        return f"""
+
+
+def _experimental_recommendation(frequency_last_year: int, annual_value: float, days_since_last_purchase: int) -> str:
+    """Recommendation text for "Experimental / Hesitant, Lower-Value Buyers" (and any unknown segment)."""
+    return f"""
         (1) Reduce friction and risk. This customer purchased only {frequency_last_year} times in the last year and generates ${annual_value} annually. Offer low-commitment incentives such as free shipping, small bundles, or first-repeat discounts to encourage a second purchase.
 
         (2)Trigger reactivation quickly. With {days_since_last_purchase} days since their last order, deploy short, time-bound reactivation campaigns focused on ease, value, and reassurance rather than upsell.
 
         (3) Test engagement before heavy investment. Monitor response to lightweight campaigns before allocating higher-cost incentives. Customers who re-engage can be upgraded into higher-touch strategies; non-responders should remain in automated flows.
         """
-    
\ No newline at end of file
+
+
+# Segment name -> recommendation builder, looked up once per call instead of
+# walking an if/elif chain of string comparisons
+_RECOMMENDATIONS_BY_SEGMENT: Dict[str, Callable[[int, float, int], str]] = {
+    "Monthly, High-Value Buyers": _monthly_high_value_recommendation,
+    "Seasonal Buyers": _seasonal_recommendation,
+    "Experimental / Hesitant, Lower-Value Buyers": _experimental_recommendation,
+}
+
+
+def _generate_recommendation(customer: CustomerRecord) -> str:
+    """
+    Generate recommendation text based on customer segment and churn risk.
+    
+    Args:
+        customer: CustomerRecord with all customer data
+    
+    Returns:
+        Text recommendation string
+    """
+    build_recommendation = _RECOMMENDATIONS_BY_SEGMENT.get(
+        customer.segment, _experimental_recommendation
+    )
+    return build_recommendation(
+        frequency_last_year=customer.frequency,
+        annual_value=customer.monetary,
+        days_since_last_purchase=customer.recency
+    )